@@ -7,37 +7,453 @@ Utility to chunk large ONNX models for ICP deployment
 import os
 import sys
 import json
+import mmap
 import hashlib
 import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
 # Configuration
 DEFAULT_CHUNK_SIZE_MB = 0.8  # ICP-compatible chunk size (800KB safe for 2MB limit)
 MAX_CHUNK_SIZE_MB = 1.0      # Maximum safe chunk size for ICP
+HASH_SLICE_SIZE = 16 * 1024 * 1024  # Hash update granularity for progress reporting
+HASH_READ_SIZE = 1024 * 1024        # Read buffer size when a file cannot be mmapped
+WRITE_QUEUE_DEPTH = 32              # Chunk writes kept in flight while chunking
+VERIFY_QUEUE_FACTOR = 4             # Chunk checks kept in flight per core while verifying
+DIRECT_IO_THRESHOLD = 256 * 1024 * 1024  # Read sources at least this large with O_DIRECT
+DIRECT_IO_ALIGNMENT = 4096          # Offset/buffer alignment required by O_DIRECT
+HASH_ALGORITHMS = ('sha256', 'blake3')
+DEFAULT_HASH_ALGO = 'sha256'        # The canister verifies uploaded chunks with SHA256
+COMPRESSION_METHODS = ('none', 'zstd', 'lz4')
+ZSTD_LEVEL = 3
+COMPRESS_READ_SIZE = 4 * 1024 * 1024  # Input/output block size for streaming compression
+FUSED_BLOCK_SIZE = 256 * 1024       # Block written then hashed together, sized to stay in L2
 
-def calculate_sha256(file_path):
-    """Calculate SHA256 hash of a file"""
-    hash_sha256 = hashlib.sha256()
+def new_hasher(hash_algo=DEFAULT_HASH_ALGO, data=b''):
+    """Create a hash object for the given algorithm"""
+    if hash_algo == 'sha256':
+        return hashlib.sha256(data)
+    if hash_algo == 'blake3':
+        if blake3 is None:
+            raise ImportError("BLAKE3 hashing requires the 'blake3' package (pip install blake3)")
+        return blake3.blake3(data)
+    raise ValueError(f"Unsupported hash algorithm: {hash_algo}")
+
+def require_compression(compression):
+    """Check that the module for a compression method is installed"""
+    if compression == 'zstd' and zstandard is None:
+        raise ImportError("zstd compression requires the 'zstandard' package (pip install zstandard)")
+    if compression == 'lz4' and lz4 is None:
+        raise ImportError("lz4 compression requires the 'lz4' package (pip install lz4)")
+    if compression not in COMPRESSION_METHODS:
+        raise ValueError(f"Unsupported compression: {compression}")
+
+def calculate_file_hash(file_path, hash_algo=DEFAULT_HASH_ALGO, quiet=False):
+    """Calculate the hash of a file with the given algorithm"""
+    hasher = new_hasher(hash_algo)
     file_size = os.path.getsize(file_path)
-    processed = 0
+    show_progress = not quiet and file_size > 50 * 1024 * 1024
+    
+    if file_size == 0:
+        return hasher.hexdigest()
     
     with open(file_path, "rb") as f:
-        while True:
-            chunk = f.read(8192)
-            if not chunk:
-                break
-            hash_sha256.update(chunk)
-            processed += len(chunk)
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            mm = None
+        
+        if mm is not None:
+            # Hand the hasher large contiguous buffers straight from the page cache
+            with mm, memoryview(mm) as view:
+                for start in range(0, file_size, HASH_SLICE_SIZE):
+                    hasher.update(view[start:start + HASH_SLICE_SIZE])
+                    
+                    # Show progress for large files
+                    if show_progress:
+                        processed = min(start + HASH_SLICE_SIZE, file_size)
+                        progress = (processed / file_size) * 100
+                        print(f"\rCalculating hash... {progress:.1f}%", end='', flush=True)
+        else:
+            # Files that cannot be mapped: large sequential reads into one reused buffer
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
             
-            # Show progress for large files
-            if file_size > 50 * 1024 * 1024:
-                progress = (processed / file_size) * 100
-                print(f"\rCalculating hash... {progress:.1f}%", end='', flush=True)
-    
-    if file_size > 50 * 1024 * 1024:
+            buffer = bytearray(HASH_READ_SIZE)
+            view = memoryview(buffer)
+            processed = 0
+            next_report = HASH_SLICE_SIZE
+            while True:
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                hasher.update(view[:n])
+                processed += n
+                
+                # Show progress for large files
+                if show_progress and (processed >= next_report or processed == file_size):
+                    progress = (processed / file_size) * 100
+                    print(f"\rCalculating hash... {progress:.1f}%", end='', flush=True)
+                    next_report += HASH_SLICE_SIZE
+    
+    if show_progress:
         print()
     
-    return hash_sha256.hexdigest()
+    return hasher.hexdigest()
+
+def calculate_merkle_root(chunk_hashes):
+    """Calculate the SHA256 root over a list of hex chunk digests, or None if any is missing"""
+    if any(chunk_hash is None for chunk_hash in chunk_hashes):
+        return None
+    return hashlib.sha256(b''.join(bytes.fromhex(h) for h in chunk_hashes)).hexdigest()
+
+def hash_region(buffer, offset, length, hash_algo=DEFAULT_HASH_ALGO):
+    """Calculate the hash of a slice of a buffer without copying it"""
+    with memoryview(buffer)[offset:offset + length] as region:
+        return new_hasher(hash_algo, region).hexdigest()
+
+def copy_file_range_into(src_fd, dst_fd, offset, count):
+    """Copy count bytes from src_fd at offset to dst_fd's current position, in-kernel where possible
+    
+    Each method continues from where the previous one stopped, since some pseudo-files
+    and filesystems make copy_file_range or sendfile return 0 without copying anything.
+    """
+    copied = 0
+    
+    # Linux: copy entirely in-kernel, no userspace buffer
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < count:
+                n = os.copy_file_range(src_fd, dst_fd, count - copied,
+                                       offset_src=offset + copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            if copied:
+                raise
+    
+    # Older kernels: sendfile between regular files
+    if hasattr(os, 'sendfile') and copied < count:
+        try:
+            while copied < count:
+                n = os.sendfile(dst_fd, src_fd, offset + copied, count - copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            if copied:
+                raise
+    
+    # Portable fallback: read/write through userspace
+    while copied < count:
+        data = os.pread(src_fd, count - copied, offset + copied)
+        if not data:
+            break
+        # os.write may write only part of the buffer
+        written = 0
+        while written < len(data):
+            written += os.write(dst_fd, data[written:])
+        copied += len(data)
+    return copied
+
+def write_chunk(src_fd, chunk_path, offset, length):
+    """Write length bytes of src_fd starting at offset to a new chunk file"""
+    dst_fd = os.open(chunk_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        copied = copy_file_range_into(src_fd, dst_fd, offset, length)
+    finally:
+        os.close(dst_fd)
+    
+    if copied != length:
+        raise IOError(f"Short write for {Path(chunk_path).name}: "
+                      f"expected {length}, wrote {copied}")
+
+def _split_copy_range(input_path, out_dir_str, chunks_info, chunk_size, file_size, hash_algo,
+                      whole_hasher=None):
+    """Write chunks with in-kernel copies and hash them from a mapping of the source
+    
+    Fills in each chunk's hash (chunks are only written when hash_algo is None) and
+    feeds the whole source to whole_hasher if one is given.
+    """
+    write_futures = {}
+    hash_futures = {}
+    
+    src_fd = os.open(input_path, os.O_RDONLY)
+    src_map = mmap.mmap(src_fd, 0, access=mmap.ACCESS_READ) if file_size > 0 else None
+    try:
+        # Keep many chunk writes in flight so the kernel can overlap them, and hash on
+        # other cores meanwhile (both copy_file_range and hashlib release the GIL)
+        with ThreadPoolExecutor(max_workers=WRITE_QUEUE_DEPTH) as write_executor, \
+                ThreadPoolExecutor(max_workers=os.cpu_count()) as hash_executor:
+            # Whole-file hash runs alongside the per-chunk hashes
+            whole_future = None
+            if whole_hasher is not None and src_map is not None:
+                whole_future = hash_executor.submit(whole_hasher.update, src_map)
+            
+            for chunk_info in chunks_info:
+                chunk_id = chunk_info["chunk_id"]
+                offset = chunk_id * chunk_size
+                
+                # Write chunk (split in-kernel, bytes never enter Python's heap)
+                write_futures[chunk_id] = write_executor.submit(
+                    write_chunk, src_fd, os.path.join(out_dir_str, chunk_info["filename"]),
+                    offset, chunk_info["size"])
+                
+                # Hash the source region straight from the mapping
+                if hash_algo is not None:
+                    hash_futures[chunk_id] = hash_executor.submit(
+                        hash_region, src_map, offset, chunk_info["size"], hash_algo)
+            
+            for chunk_info in chunks_info:
+                write_futures[chunk_info["chunk_id"]].result()
+                if hash_algo is not None:
+                    chunk_info["hash"] = hash_futures[chunk_info["chunk_id"]].result()
+            
+            if whole_future is not None:
+                whole_future.result()
+    finally:
+        if src_map is not None:
+            src_map.close()
+        os.close(src_fd)
+
+def _write_and_hash_chunk(chunk_path, data, hash_algo):
+    """Write a chunk buffer to its file and return its hash (None if hash_algo is None)"""
+    hasher = new_hasher(hash_algo) if hash_algo is not None else None
+    with data:
+        with open(chunk_path, 'wb') as chunk_file:
+            # Write and hash each block while it is still cache-resident
+            for start in range(0, len(data), FUSED_BLOCK_SIZE):
+                block = data[start:start + FUSED_BLOCK_SIZE]
+                chunk_file.write(block)
+                if hasher is not None:
+                    hasher.update(block)
+    return hasher.hexdigest() if hasher is not None else None
+
+def _update_hasher(hasher, data):
+    """Feed a buffer view to a hasher and release the view"""
+    with data:
+        hasher.update(data)
+
+def _split_direct(input_path, out_dir_str, chunks_info, chunk_size, hash_algo, whole_hasher=None):
+    """Write and hash chunks from O_DIRECT reads of the source into aligned buffers
+    
+    Fills in each chunk's hash and feeds the whole source to whole_hasher if one is
+    given. Returns False if the platform or filesystem does not support O_DIRECT
+    (nothing is written then).
+    """
+    if not (hasattr(os, 'O_DIRECT') and hasattr(os, 'preadv')):
+        return False
+    
+    try:
+        src_fd = os.open(input_path, os.O_RDONLY | os.O_DIRECT)
+    except OSError:
+        return False
+    
+    # Anonymous mappings are page aligned, as O_DIRECT requires. The ring is sized like the
+    # write queue, not by core count, so reads keep running ahead of pending writes.
+    buffer_size = _align_up(chunk_size + DIRECT_IO_ALIGNMENT, DIRECT_IO_ALIGNMENT)
+    ring_size = WRITE_QUEUE_DEPTH
+    buffers = [mmap.mmap(-1, buffer_size) for _ in range(ring_size)]
+    try:
+        # Some filesystems accept O_DIRECT at open time but reject the reads
+        try:
+            os.preadv(src_fd, [buffers[0]], 0)
+        except OSError:
+            return False
+        
+        pending = [()] * ring_size
+        futures = []
+        # The whole-file hash must see chunks in order, so it gets a single worker of its
+        # own rather than running on the read loop
+        with ThreadPoolExecutor(max_workers=ring_size) as executor, \
+                ThreadPoolExecutor(max_workers=1) as whole_executor:
+            for chunk_info in chunks_info:
+                # Reuse a buffer only once its previous chunk is written and hashed
+                slot = chunk_info["chunk_id"] % ring_size
+                for future in pending[slot]:
+                    future.result()
+                
+                offset = chunk_info["chunk_id"] * chunk_size
+                aligned_offset = offset - offset % DIRECT_IO_ALIGNMENT
+                start = offset - aligned_offset
+                end = start + chunk_info["size"]
+                
+                with memoryview(buffers[slot]) as view:
+                    filled = 0
+                    while filled < end:
+                        n = os.preadv(src_fd, [view[filled:_align_up(end, DIRECT_IO_ALIGNMENT)]],
+                                      aligned_offset + filled)
+                        if n == 0:
+                            raise IOError(f"Unexpected end of file reading {input_path}")
+                        filled += n
+                    
+                    data = view[start:end]
+                    whole_data = view[start:end] if whole_hasher is not None else None
+                
+                chunk_future = executor.submit(
+                    _write_and_hash_chunk, os.path.join(out_dir_str, chunk_info["filename"]),
+                    data, hash_algo)
+                futures.append(chunk_future)
+                pending[slot] = (chunk_future,)
+                if whole_data is not None:
+                    pending[slot] += (whole_executor.submit(_update_hasher, whole_hasher, whole_data),)
+                del data, whole_data
+            
+            for chunk_info, future in zip(chunks_info, futures):
+                chunk_info["hash"] = future.result()
+            for slot_futures in pending:
+                for future in slot_futures:
+                    future.result()
+        
+        return True
+    finally:
+        os.close(src_fd)
+        for buffer in buffers:
+            buffer.close()
+
+class _HashingReader:
+    """File wrapper that feeds every block read through it into a hasher"""
+    
+    def __init__(self, infile, hasher):
+        self._infile = infile
+        self._hasher = hasher
+    
+    def read(self, size=-1):
+        data = self._infile.read(size)
+        self._hasher.update(data)
+        return data
+
+def _iter_compressed(input_path, compression, hasher=None):
+    """Yield the compressed bytes of a file block by block
+    
+    When a hasher is given it is updated with the uncompressed bytes as they are read.
+    """
+    with open(input_path, 'rb') as infile:
+        if compression == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1)
+            source = infile if hasher is None else _HashingReader(infile, hasher)
+            with compressor.stream_reader(source, closefd=False) as reader:
+                while True:
+                    block = reader.read(COMPRESS_READ_SIZE)
+                    if not block:
+                        break
+                    yield block
+        else:
+            compressor = lz4.frame.LZ4FrameCompressor()
+            yield compressor.begin()
+            while True:
+                data = infile.read(COMPRESS_READ_SIZE)
+                if not data:
+                    break
+                if hasher is not None:
+                    hasher.update(data)
+                yield compressor.compress(data)
+            yield compressor.flush()
+
+def _split_compressed(input_path, out_dir_str, chunk_size, compression, hash_algo,
+                      whole_hasher=None):
+    """Compress a file as a stream and cut the compressed bytes into chunks
+    
+    Returns the chunk infos (chunks are only written when hash_algo is None). The
+    uncompressed bytes are fed to whole_hasher, if given, from the same read that
+    feeds the compressor.
+    """
+    chunks_info = []
+    futures = []
+    
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        # Chunks are assembled in a fixed ring of reused buffers, which also caps how
+        # many compressed chunks are held in memory while their writes are pending
+        buffers = []
+        
+        def next_buffer():
+            chunk_id = len(chunks_info)
+            slot = chunk_id % WRITE_QUEUE_DEPTH
+            if slot < len(buffers):
+                futures[chunk_id - WRITE_QUEUE_DEPTH].result()
+            else:
+                buffers.append(bytearray(chunk_size))
+            return memoryview(buffers[slot])
+        
+        def emit(data):
+            chunk_filename = f"model_chunk_{len(chunks_info):03d}.bin"
+            chunks_info.append({
+                "chunk_id": len(chunks_info),
+                "filename": chunk_filename,
+                "size": len(data),
+                "hash": None
+            })
+            futures.append(executor.submit(
+                _write_and_hash_chunk, os.path.join(out_dir_str, chunk_filename), data, hash_algo))
+        
+        view = next_buffer()
+        filled = 0
+        for block in _iter_compressed(input_path, compression, whole_hasher):
+            block = memoryview(block)
+            while block:
+                n = min(chunk_size - filled, len(block))
+                view[filled:filled + n] = block[:n]
+                block = block[n:]
+                filled += n
+                if filled == chunk_size:
+                    emit(view)
+                    view = next_buffer()
+                    filled = 0
+        if filled:
+            emit(view[:filled])
+        
+        for chunk_info, future in zip(chunks_info, futures):
+            chunk_info["hash"] = future.result()
+    
+    return chunks_info
+
+def _decompress_into(outfile, compression):
+    """
+    Return a callable that decompresses successive compressed chunks into outfile
+    
+    The callable raises ValueError when the compressed stream is corrupt.
+    """
+    if compression == 'zstd':
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        stream_error = zstandard.ZstdError
+    else:
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        stream_error = RuntimeError
+    
+    def decompress(data):
+        try:
+            decompressed = decompressor.decompress(data)
+        except stream_error as e:
+            raise ValueError(f"corrupt {compression} stream: {e}") from e
+        outfile.write(decompressed)
+    
+    return decompress
+
+def _align_up(value, alignment):
+    """Round value up to a multiple of alignment"""
+    return (value + alignment - 1) // alignment * alignment
 
 def format_file_size(size_bytes):
     """Format file size in human readable format"""
@@ -50,7 +466,9 @@ def format_file_size(size_bytes):
     else:
         return f"{size_bytes / (1024 * 1024 * 1024):.1f} GB"
 
-def chunk_model(input_file, output_dir, chunk_size_mb=DEFAULT_CHUNK_SIZE_MB):
+def chunk_model(input_file, output_dir, chunk_size_mb=DEFAULT_CHUNK_SIZE_MB,
+                hash_algo=DEFAULT_HASH_ALGO, quiet=False, compute_hashes=True,
+                compression='none'):
     """
     Chunk a large model file into smaller pieces suitable for ICP
     
@@ -58,6 +476,14 @@ def chunk_model(input_file, output_dir, chunk_size_mb=DEFAULT_CHUNK_SIZE_MB):
         input_file: Path to the input model file
         output_dir: Directory to save chunks
         chunk_size_mb: Size of each chunk in MB (default: 15MB for ICP)
+        hash_algo: Per-chunk hash algorithm, 'sha256' or 'blake3' (default: sha256).
+            With BLAKE3 or compression the whole file is also hashed with SHA256;
+            raw SHA256 chunks already cover every byte, so no whole-file hash is taken.
+        quiet: Skip the per-chunk progress lines
+        compute_hashes: Hash chunks while splitting. When False only sizes are
+            recorded; run verify_chunks later to fill in the hashes.
+        compression: Compress the model before chunking, 'none', 'zstd' or 'lz4'
+            (default: none). Fewer chunks, but only reconstruct_model can read them.
     
     Returns:
         dict: Metadata about the chunked model
@@ -72,6 +498,15 @@ def chunk_model(input_file, output_dir, chunk_size_mb=DEFAULT_CHUNK_SIZE_MB):
     if not input_path.is_file():
         raise ValueError(f"Input path is not a file: {input_file}")
     
+    # Validate hash algorithm before any work is done
+    new_hasher(hash_algo)
+    if hash_algo != 'sha256':
+        print(f"⚠️  Warning: {hash_algo} chunk hashes cannot be uploaded; the canister verifies chunks with SHA256")
+    
+    require_compression(compression)
+    if compression != 'none':
+        print(f"⚠️  Warning: {compression} compressed chunks cannot be uploaded; the canister expects the raw model")
+    
     # Validate chunk size
     if chunk_size_mb > MAX_CHUNK_SIZE_MB:
         print(f"⚠️  Warning: Chunk size {chunk_size_mb}MB exceeds recommended maximum {MAX_CHUNK_SIZE_MB}MB for ICP")
@@ -89,39 +524,50 @@ def chunk_model(input_file, output_dir, chunk_size_mb=DEFAULT_CHUNK_SIZE_MB):
     print(f"📦 Chunking model: {input_path.name}")
     print(f"📊 File size: {format_file_size(file_size)}")
     print(f"🔢 Chunk size: {chunk_size_mb} MB")
-    print(f"📈 Total chunks: {total_chunks}")
+    if compression == 'none':
+        print(f"📈 Total chunks: {total_chunks}")
+    else:
+        print(f"🗜️  Compression: {compression}")
+    print(f"🔐 Chunk hash: {hash_algo if compute_hashes else 'skipped'}")
     print()
     
-    chunks_info = []
-    chunk_id = 0
+    out_dir_str = str(output_path)
     
-    with open(input_path, 'rb') as infile:
-        while True:
-            chunk_data = infile.read(chunk_size)
-            if not chunk_data:
-                break
-            
-            # Write chunk
-            chunk_filename = f"model_chunk_{chunk_id:03d}.bin"
-            chunk_path = output_path / chunk_filename
-            
-            with open(chunk_path, 'wb') as chunk_file:
-                chunk_file.write(chunk_data)
-            
-            # Calculate hash
-            chunk_hash = calculate_sha256(chunk_path)
-            
-            # Store chunk info
-            chunk_info = {
+    # A whole-file SHA256 is only needed when the chunk hashes are not already SHA256 of
+    # the raw bytes; otherwise reconstruct --verify checks the chunks themselves
+    whole_hasher = None
+    if compute_hashes and (hash_algo != 'sha256' or compression != 'none'):
+        whole_hasher = hashlib.sha256()
+    
+    if compression != 'none':
+        # Compressed chunk boundaries are only known as the compressed stream is produced
+        chunks_info = _split_compressed(input_path, out_dir_str, chunk_size, compression,
+                                        hash_algo if compute_hashes else None, whole_hasher)
+    else:
+        chunks_info = []
+        for chunk_id in range(total_chunks):
+            chunks_info.append({
                 "chunk_id": chunk_id,
-                "filename": chunk_filename,
-                "size": len(chunk_data),
-                "hash": chunk_hash
-            }
-            chunks_info.append(chunk_info)
-            
-            print(f"Created {chunk_filename} ({len(chunk_data)} bytes)")
-            chunk_id += 1
+                "filename": f"model_chunk_{chunk_id:03d}.bin",
+                "size": min(chunk_size, file_size - chunk_id * chunk_size),
+                "hash": None
+            })
+        
+        # Large models are read with O_DIRECT so a read-once source does not evict the page cache.
+        # Without hashing the bytes never need to reach userspace, so the in-kernel copy wins.
+        written = False
+        if compute_hashes and file_size >= DIRECT_IO_THRESHOLD:
+            written = _split_direct(input_path, out_dir_str, chunks_info, chunk_size, hash_algo,
+                                    whole_hasher)
+        if not written:
+            _split_copy_range(input_path, out_dir_str, chunks_info, chunk_size, file_size,
+                              hash_algo if compute_hashes else None, whole_hasher)
+    
+    whole_sha256 = whole_hasher.hexdigest() if whole_hasher is not None else None
+    
+    if not quiet and chunks_info:
+        print("\n".join(f"Created {info['filename']} ({info['size']} bytes)"
+                        for info in chunks_info))
     
     # Create metadata
     metadata = {
@@ -129,6 +575,12 @@ def chunk_model(input_file, output_dir, chunk_size_mb=DEFAULT_CHUNK_SIZE_MB):
         "original_size": file_size,
         "total_chunks": len(chunks_info),
         "chunk_size_mb": chunk_size_mb,
+        "hash_algo": hash_algo,
+        "whole_sha256": whole_sha256,
+        "merkle_root": calculate_merkle_root([info["hash"] for info in chunks_info]),
+        "compression": compression,
+        "compressed": compression != 'none',
+        "uncompressed_size": file_size,
         "chunks": chunks_info
     }
     
@@ -140,10 +592,68 @@ def chunk_model(input_file, output_dir, chunk_size_mb=DEFAULT_CHUNK_SIZE_MB):
     print(f"\nChunking complete!")
     print(f"Total chunks: {len(chunks_info)}")
     print(f"Metadata saved to: {metadata_path}")
+    if not compute_hashes:
+        print("Chunk hashes were skipped; run 'verify' to record them before uploading")
     
     return metadata
 
-def verify_chunks(chunks_dir):
+def load_metadata(metadata_path):
+    """
+    Load chunk metadata, streaming the chunk list when ijson is available
+    
+    Returns:
+        tuple: (metadata without 'chunks', iterator over chunk info dicts)
+    """
+    if ijson is not None:
+        # chunk_model writes every top-level field before the chunk list, so the
+        # header is complete once the list starts and chunks can be consumed lazily
+        metadata = {}
+        with open(metadata_path, 'rb') as f:
+            for prefix, event, value in ijson.parse(f, use_float=True):
+                if prefix == 'chunks' and event == 'start_array':
+                    break
+                if '.' not in prefix and event in ('string', 'number', 'boolean', 'null'):
+                    metadata[prefix] = value
+        
+        if 'total_chunks' in metadata:
+            def iter_chunks():
+                with open(metadata_path, 'rb') as f:
+                    yield from ijson.items(f, 'chunks.item', use_float=True)
+            
+            return metadata, iter_chunks()
+    
+    with open(metadata_path, 'r') as f:
+        metadata = json.load(f)
+    return metadata, iter(metadata.pop('chunks'))
+
+def _verify_one(chunks_dir_str, chunk_info, hash_algo):
+    """Check a single chunk against its metadata, returning (valid, message)
+    
+    A chunk recorded without a hash is hashed and the hash is filled into its metadata.
+    """
+    chunk_path = os.path.join(chunks_dir_str, chunk_info['filename'])
+    
+    try:
+        actual_size = os.stat(chunk_path).st_size
+    except FileNotFoundError:
+        return False, f"❌ Missing: {chunk_info['filename']}"
+    
+    # Check size
+    if actual_size != chunk_info['size']:
+        return False, (f"❌ Size mismatch: {chunk_info['filename']} "
+                       f"(expected {chunk_info['size']}, got {actual_size})")
+    
+    # Check hash
+    actual_hash = calculate_file_hash(chunk_path, hash_algo)
+    if chunk_info['hash'] is None:
+        chunk_info['hash'] = actual_hash
+        return True, f"✅ {chunk_info['filename']} (hash recorded)"
+    if actual_hash != chunk_info['hash']:
+        return False, f"❌ Hash mismatch: {chunk_info['filename']}"
+    
+    return True, f"✅ {chunk_info['filename']}"
+
+def verify_chunks(chunks_dir, quiet=False):
     """Verify chunk integrity using metadata"""
     chunks_path = Path(chunks_dir)
     metadata_path = chunks_path / "model_metadata.json"
@@ -152,36 +662,59 @@ def verify_chunks(chunks_dir):
         print("Error: model_metadata.json not found")
         return False
     
-    with open(metadata_path, 'r') as f:
-        metadata = json.load(f)
+    metadata, chunks_iter = load_metadata(metadata_path)
     
-    print(f"Verifying {metadata['total_chunks']} chunks...")
+    # Metadata written before hash_algo existed always used SHA256
+    hash_algo = metadata.get('hash_algo', 'sha256')
+    print(f"Verifying {metadata['total_chunks']} chunks ({hash_algo})...")
     
+    # Start hashing each chunk as soon as it has been parsed, and report results in
+    # order as they finish so only a bounded window of chunks is held in memory
     all_valid = True
-    for chunk_info in metadata['chunks']:
-        chunk_path = chunks_path / chunk_info['filename']
-        
-        if not chunk_path.exists():
-            print(f"❌ Missing: {chunk_info['filename']}")
-            all_valid = False
-            continue
-        
-        # Check size
-        actual_size = chunk_path.stat().st_size
-        if actual_size != chunk_info['size']:
-            print(f"❌ Size mismatch: {chunk_info['filename']} "
-                  f"(expected {chunk_info['size']}, got {actual_size})")
+    recorded_hashes = {}
+    pending = deque()
+    max_pending = VERIFY_QUEUE_FACTOR * (os.cpu_count() or 1)
+    chunks_dir_str = str(chunks_path)
+    
+    def report_oldest():
+        nonlocal all_valid
+        index, chunk_info, hash_missing, future = pending.popleft()
+        valid, message = future.result()
+        if not valid:
             all_valid = False
-            continue
+            print(message)
+        else:
+            if hash_missing:
+                recorded_hashes[index] = chunk_info['hash']
+            if not quiet:
+                print(message)
+    
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for index, chunk_info in enumerate(chunks_iter):
+            hash_missing = chunk_info['hash'] is None
+            future = executor.submit(_verify_one, chunks_dir_str, chunk_info, hash_algo)
+            pending.append((index, chunk_info, hash_missing, future))
+            if len(pending) >= max_pending:
+                report_oldest()
         
-        # Check hash
-        actual_hash = calculate_sha256(chunk_path)
-        if actual_hash != chunk_info['hash']:
-            print(f"❌ Hash mismatch: {chunk_info['filename']}")
-            all_valid = False
-            continue
+        while pending:
+            report_oldest()
+    
+    # Record hashes skipped at chunk time, but never on top of a failed verification.
+    # Only this rewrite needs the full chunk list, so it re-reads the metadata.
+    if recorded_hashes and all_valid:
+        _, chunks_iter = load_metadata(metadata_path)
+        chunks = []
+        for index, chunk_info in enumerate(chunks_iter):
+            if index in recorded_hashes:
+                chunk_info['hash'] = recorded_hashes[index]
+            chunks.append(chunk_info)
         
-        print(f"✅ {chunk_info['filename']}")
+        metadata['merkle_root'] = calculate_merkle_root([info['hash'] for info in chunks])
+        metadata['chunks'] = chunks
+        with open(metadata_path, 'w') as f:
+            json.dump(metadata, f, indent=2)
+        print(f"\n🔐 Recorded {len(recorded_hashes)} missing chunk hashes in {metadata_path.name}")
     
     if all_valid:
         print("\n🎉 All chunks verified successfully!")
@@ -190,8 +723,14 @@ def verify_chunks(chunks_dir):
     
     return all_valid
 
-def reconstruct_model(chunks_dir, output_file):
-    """Reconstruct model from chunks"""
+def reconstruct_model(chunks_dir, output_file, quiet=False, verify=False):
+    """
+    Reconstruct model from chunks
+    
+    The chunk hashes are checked against the recorded Merkle root. With verify=True
+    the reconstructed file is also hashed and compared to the recorded whole-file SHA256,
+    or, for metadata without one, every chunk file is checked against its recorded hash.
+    """
     chunks_path = Path(chunks_dir)
     metadata_path = chunks_path / "model_metadata.json"
     
@@ -199,35 +738,102 @@ def reconstruct_model(chunks_dir, output_file):
         print("Error: model_metadata.json not found")
         return False
     
-    with open(metadata_path, 'r') as f:
-        metadata = json.load(f)
+    metadata, chunks_iter = load_metadata(metadata_path)
     
     print(f"Reconstructing model from {metadata['total_chunks']} chunks...")
     
+    chunks_dir_str = str(chunks_path)
+    added = []
+    
+    # Fold the chunk hashes into the Merkle root as the chunks stream past, so the
+    # chunk list is never held in memory
+    merkle = hashlib.sha256()
+    hashes_complete = True
+    
+    compression = metadata.get('compression', 'none')
+    require_compression(compression)
+    
     with open(output_file, 'wb') as outfile:
-        for chunk_info in metadata['chunks']:
-            chunk_path = chunks_path / chunk_info['filename']
+        out_fd = outfile.fileno()
+        if compression != 'none':
+            decompress = _decompress_into(outfile, compression)
+            read_buffer = bytearray()
+        
+        for chunk_info in chunks_iter:
+            chunk_path = os.path.join(chunks_dir_str, chunk_info['filename'])
             
-            if not chunk_path.exists():
+            try:
+                chunk_fd = os.open(chunk_path, os.O_RDONLY)
+            except FileNotFoundError:
                 print(f"Error: Missing chunk {chunk_info['filename']}")
                 return False
             
-            with open(chunk_path, 'rb') as chunk_file:
-                chunk_data = chunk_file.read()
-                outfile.write(chunk_data)
+            try:
+                if compression != 'none':
+                    # Decompress on the fly, the compressed stream spans chunk boundaries.
+                    # Chunks are read into one reused buffer rather than a new bytes each.
+                    chunk_file_size = os.fstat(chunk_fd).st_size
+                    if chunk_file_size > len(read_buffer):
+                        read_buffer = bytearray(chunk_file_size)
+                    with open(chunk_fd, 'rb', closefd=False) as chunk_file, \
+                            memoryview(read_buffer) as view:
+                        n = chunk_file.readinto(view[:chunk_file_size])
+                        try:
+                            decompress(view[:n])
+                        except ValueError as e:
+                            print(f"Error: Cannot decompress {chunk_info['filename']}: {e}")
+                            return False
+                else:
+                    # Append the whole chunk in-kernel; the size check below catches short chunks
+                    copy_file_range_into(chunk_fd, out_fd, 0, os.fstat(chunk_fd).st_size)
+            finally:
+                os.close(chunk_fd)
             
-            print(f"Added {chunk_info['filename']}")
+            if chunk_info['hash'] is None:
+                hashes_complete = False
+            elif hashes_complete:
+                merkle.update(bytes.fromhex(chunk_info['hash']))
+            if not quiet:
+                added.append(chunk_info['filename'])
+    
+    if added:
+        print("\n".join(f"Added {filename}" for filename in added))
     
     # Verify reconstructed file size
     reconstructed_size = Path(output_file).stat().st_size
-    if reconstructed_size == metadata['original_size']:
-        print(f"\n✅ Model reconstructed successfully: {output_file}")
-        print(f"Size: {reconstructed_size} bytes")
-        return True
-    else:
+    if reconstructed_size != metadata['original_size']:
         print(f"\n❌ Size mismatch after reconstruction!")
         print(f"Expected: {metadata['original_size']}, Got: {reconstructed_size}")
         return False
+    
+    # Check the chunk hashes used against the recorded root (metadata only, no file I/O)
+    expected_root = metadata.get('merkle_root')
+    chunk_root = merkle.hexdigest() if hashes_complete else None
+    if expected_root is not None and chunk_root != expected_root:
+        print(f"\n❌ Merkle root mismatch: chunk hashes do not match the recorded root!")
+        return False
+    
+    if verify:
+        expected_sha256 = metadata.get('whole_sha256')
+        if expected_sha256 is not None:
+            if calculate_file_hash(output_file, 'sha256', quiet) != expected_sha256:
+                print(f"\n❌ Hash mismatch after reconstruction!")
+                print(f"Expected: {expected_sha256}")
+                return False
+        elif not hashes_complete:
+            print(f"\n❌ No hashes recorded, cannot verify content; run 'verify' on {chunks_dir} first")
+            return False
+        else:
+            # No whole-file SHA256 (raw SHA256 chunks, or older metadata): check every
+            # chunk against its own hash, re-streaming the metadata
+            print()
+            if not verify_chunks(chunks_dir, quiet=True):
+                print(f"\n❌ Chunk verification failed during reconstruction!")
+                return False
+    
+    print(f"\n✅ Model reconstructed successfully: {output_file}")
+    print(f"Size: {reconstructed_size} bytes")
+    return True
 
 def main():
     parser = argparse.ArgumentParser(description="VeriChain Model Chunker")
@@ -239,25 +845,44 @@ def main():
     chunk_parser.add_argument('output', help='Output directory for chunks')
     chunk_parser.add_argument('--size', type=float, default=DEFAULT_CHUNK_SIZE_MB, 
                              help=f'Chunk size in MB (default: {DEFAULT_CHUNK_SIZE_MB})')
+    chunk_parser.add_argument('--hash-algo', choices=HASH_ALGORITHMS, default=DEFAULT_HASH_ALGO,
+                             help='Per-chunk hash algorithm; blake3 needs the blake3 package '
+                                  f'and cannot be uploaded to the canister (default: {DEFAULT_HASH_ALGO})')
+    chunk_parser.add_argument('--quiet', '-q', action='store_true',
+                             help='Do not print a line per chunk')
+    chunk_parser.add_argument('--compress', choices=COMPRESSION_METHODS, default='none',
+                             help='Compress the model before chunking; needs the zstandard or lz4 '
+                                  'package and cannot be uploaded to the canister (default: none)')
+    chunk_parser.add_argument('--no-hash', dest='compute_hashes', action='store_false',
+                             help="Skip chunk hashing and record sizes only; run 'verify' "
+                                  'later to record hashes (required before uploading)')
     
     # Verify command
     verify_parser = subparsers.add_parser('verify', help='Verify chunk integrity')
     verify_parser.add_argument('chunks_dir', help='Directory containing chunks')
+    verify_parser.add_argument('--quiet', '-q', action='store_true',
+                              help='Only print chunks that fail verification')
     
     # Reconstruct command
     reconstruct_parser = subparsers.add_parser('reconstruct', 
                                               help='Reconstruct model from chunks')
     reconstruct_parser.add_argument('chunks_dir', help='Directory containing chunks')
     reconstruct_parser.add_argument('output', help='Output model file')
+    reconstruct_parser.add_argument('--quiet', '-q', action='store_true',
+                                   help='Do not print a line per chunk')
+    reconstruct_parser.add_argument('--verify', action='store_true',
+                                   help='Check the reconstructed content against the recorded whole-file '
+                                        'SHA256, or against the chunk hashes when none is recorded')
     
     args = parser.parse_args()
     
     if args.command == 'chunk':
-        chunk_model(args.input, args.output, args.size)
+        chunk_model(args.input, args.output, args.size, args.hash_algo, args.quiet,
+                    args.compute_hashes, args.compress)
     elif args.command == 'verify':
-        verify_chunks(args.chunks_dir)
+        verify_chunks(args.chunks_dir, args.quiet)
     elif args.command == 'reconstruct':
-        reconstruct_model(args.chunks_dir, args.output)
+        reconstruct_model(args.chunks_dir, args.output, args.quiet, args.verify)
     else:
         parser.print_help()
 
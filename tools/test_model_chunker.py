@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Round-trip tests for the VeriChain Model Chunker
+
+Run with: python -m unittest discover -s tools
+"""
+
+import contextlib
+import hashlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import model_chunker
+
+CHUNK_SIZE_MB = 0.3  # Not a multiple of the O_DIRECT alignment, so chunk offsets are unaligned
+MODEL_SIZE = 2 * 1024 * 1024 + 12345  # Several chunks, the last one partial
+
+# Compression methods whose module is installed
+COMPRESSIONS = [compression for compression, module in
+                (('none', True), ('zstd', model_chunker.zstandard), ('lz4', model_chunker.lz4))
+                if module]
+
+def run_quietly(func, *args):
+    """Call a chunker entry point with its console output suppressed"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args)
+
+class ChunkerTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def make_model(self, size):
+        """Write a model file of random bytes and return its path and contents"""
+        data = os.urandom(size)
+        path = self.tmp / f"model_{size}.onnx"
+        path.write_bytes(data)
+        return path, data
+
+    def chunk(self, model_path, name, hash_algo='sha256', compute_hashes=True, compression='none'):
+        """Chunk a model into a fresh directory and return it with the metadata"""
+        chunks_dir = self.tmp / name
+        metadata = run_quietly(model_chunker.chunk_model, model_path, chunks_dir, CHUNK_SIZE_MB,
+                               hash_algo, True, compute_hashes, compression)
+        return chunks_dir, metadata
+
+    def reconstruct(self, chunks_dir, verify=True):
+        """Reconstruct a model and return whether it succeeded and the rebuilt bytes"""
+        output = self.tmp / f"{chunks_dir.name}.rebuilt.onnx"
+        ok = run_quietly(model_chunker.reconstruct_model, chunks_dir, output, True, verify)
+        return ok, output.read_bytes() if output.exists() else None
+
+    def corrupt_chunk(self, chunks_dir, chunk_id, position=None):
+        """Flip one byte of a chunk file, by default in the middle"""
+        chunk_path = chunks_dir / f"model_chunk_{chunk_id:03d}.bin"
+        data = bytearray(chunk_path.read_bytes())
+        data[len(data) // 2 if position is None else position] ^= 0xFF
+        chunk_path.write_bytes(data)
+
+class RoundTripTest(ChunkerTestCase):
+    def test_round_trip(self):
+        model_path, data = self.make_model(MODEL_SIZE)
+        for compression in COMPRESSIONS:
+            with self.subTest(compression=compression):
+                chunks_dir, metadata = self.chunk(model_path, compression, compression=compression)
+                # Compressed streams must span several chunks to exercise the buffer ring
+                self.assertGreater(metadata['total_chunks'], 1)
+                self.assertTrue(run_quietly(model_chunker.verify_chunks, chunks_dir, True))
+                self.assertEqual(self.reconstruct(chunks_dir), (True, data))
+
+    def test_empty_input(self):
+        model_path, _ = self.make_model(0)
+        for compression in COMPRESSIONS:
+            with self.subTest(compression=compression):
+                chunks_dir, _ = self.chunk(model_path, compression, compression=compression)
+                self.assertTrue(run_quietly(model_chunker.verify_chunks, chunks_dir, True))
+                self.assertEqual(self.reconstruct(chunks_dir), (True, b''))
+
+    def test_verify_records_skipped_hashes(self):
+        model_path, data = self.make_model(MODEL_SIZE)
+        for compression in COMPRESSIONS:
+            with self.subTest(compression=compression):
+                _, hashed = self.chunk(model_path, f"{compression}-hashed", compression=compression)
+                chunks_dir, skipped = self.chunk(model_path, f"{compression}-skipped",
+                                                 compute_hashes=False, compression=compression)
+                self.assertTrue(all(info['hash'] is None for info in skipped['chunks']))
+                self.assertIsNone(skipped['merkle_root'])
+
+                # Without hashes the content cannot be verified
+                self.assertFalse(self.reconstruct(chunks_dir)[0])
+
+                self.assertTrue(run_quietly(model_chunker.verify_chunks, chunks_dir, True))
+                recorded = json.loads((chunks_dir / "model_metadata.json").read_text())
+                self.assertEqual(recorded['chunks'], hashed['chunks'])
+                self.assertEqual(recorded['merkle_root'], hashed['merkle_root'])
+                self.assertEqual(self.reconstruct(chunks_dir), (True, data))
+
+    def test_reconstruct_verify_catches_corrupt_chunk(self):
+        model_path, _ = self.make_model(MODEL_SIZE)
+        cases = [('sha256', compression) for compression in COMPRESSIONS]
+        if model_chunker.blake3 is not None:
+            cases.append(('blake3', 'none'))
+        for hash_algo, compression in cases:
+            with self.subTest(hash_algo=hash_algo, compression=compression):
+                chunks_dir, _ = self.chunk(model_path, f"{hash_algo}-{compression}",
+                                           hash_algo, compression=compression)
+                self.corrupt_chunk(chunks_dir, 1)
+                self.assertFalse(self.reconstruct(chunks_dir)[0])
+
+    def test_reconstruct_rejects_corrupt_stream(self):
+        model_path, _ = self.make_model(MODEL_SIZE)
+        for compression in COMPRESSIONS:
+            if compression == 'none':
+                continue
+            with self.subTest(compression=compression):
+                chunks_dir, _ = self.chunk(model_path, compression, compression=compression)
+                # Break the frame header so the decompressor itself fails
+                self.corrupt_chunk(chunks_dir, 0, 0)
+                self.assertFalse(self.reconstruct(chunks_dir, verify=False)[0])
+
+class DirectIOTest(ChunkerTestCase):
+    def chunk_direct(self, model_path, name, hash_algo):
+        """Chunk through the O_DIRECT path, skipping if the filesystem does not support it"""
+        results = []
+        split_direct = model_chunker._split_direct
+
+        def record(*args):
+            results.append(split_direct(*args))
+            return results[-1]
+
+        with mock.patch.object(model_chunker, 'DIRECT_IO_THRESHOLD', 1), \
+                mock.patch.object(model_chunker, '_split_direct', record):
+            chunks_dir, metadata = self.chunk(model_path, name, hash_algo)
+
+        if results != [True]:
+            self.skipTest("O_DIRECT is not supported here")
+        return chunks_dir, metadata
+
+    def check_matches_copy_range(self, hash_algo):
+        # More chunks than the buffer ring, so every buffer is reused
+        chunk_size = int(CHUNK_SIZE_MB * 1024 * 1024)
+        model_path, data = self.make_model(chunk_size * (model_chunker.WRITE_QUEUE_DEPTH + 5) + 123)
+
+        direct_dir, direct = self.chunk_direct(model_path, 'direct', hash_algo)
+        copy_dir, copied = self.chunk(model_path, 'copy', hash_algo)
+
+        self.assertEqual(direct, copied)
+        for chunk_info in direct['chunks']:
+            self.assertEqual((direct_dir / chunk_info['filename']).read_bytes(),
+                             (copy_dir / chunk_info['filename']).read_bytes())
+
+        output = self.tmp / 'rebuilt.onnx'
+        self.assertTrue(run_quietly(model_chunker.reconstruct_model, direct_dir, output, True, True))
+        self.assertEqual(output.read_bytes(), data)
+        return direct, data
+
+    def test_sha256_matches_copy_range(self):
+        direct, _ = self.check_matches_copy_range('sha256')
+        self.assertIsNone(direct['whole_sha256'])
+
+    @unittest.skipIf(model_chunker.blake3 is None, "blake3 is not installed")
+    def test_blake3_matches_copy_range(self):
+        direct, data = self.check_matches_copy_range('blake3')
+        self.assertEqual(direct['whole_sha256'], hashlib.sha256(data).hexdigest())
+
+if __name__ == '__main__':
+    unittest.main()